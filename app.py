@@ -1,39 +1,127 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import zipfile
+import zlib
+import hashlib
+import csv
 import io
 import tempfile
 import os
 import re
+import functools
 from datetime import datetime
 from dateutil import parser as date_parser
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.worksheet.cell_range import MultiCellRange
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.styles.borders import DEFAULT_BORDER
 from openpyxl.utils.dataframe import dataframe_to_rows
 
 
+# Style definitions shared by the Excel builders. openpyxl style objects are
+# immutable, so one instance can be assigned to any number of cells.
+HEADER_FONT = Font(bold=True, size=12)
+HEADER_FONT_WHITE = Font(bold=True, size=12, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+CATEGORY_FONT = Font(bold=True, size=11)
+CATEGORY_FILL = PatternFill(start_color="B4C6E7", end_color="B4C6E7", fill_type="solid")
+WEIGHT_FILL = PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid")  # Light orange for weighted section
+EXCUSED_FILL = PatternFill(start_color="FFE699", end_color="FFE699", fill_type="solid")  # Light orange/yellow for excused
+ZERO_SCORE_FILL = PatternFill(start_color="FFCCCB", end_color="FFCCCB", fill_type="solid")  # Light red for zero scores
+SCORE_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Light green for scores above zero
+SUMMARY_FILL = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")  # Green for final grade / attendance rate
+PRESENT_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Green for 1 (present)
+ABSENT_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")  # Light red/orange for 0 (absent)
+BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+CENTER_ALIGN = Alignment(horizontal='center', vertical='center')
+
+# Combinations of the styles above used by the Excel builders. Each one is
+# registered on the workbook as a named style, so a cell picks up its font,
+# fill, border and alignment with a single assignment.
+CELL_STYLES = {
+    "info": dict(font=HEADER_FONT),
+    "header": dict(font=HEADER_FONT_WHITE, fill=HEADER_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "section": dict(font=HEADER_FONT_WHITE, fill=HEADER_FILL, border=BORDER),
+    "section_fill": dict(fill=HEADER_FILL, border=BORDER),
+    "category": dict(font=CATEGORY_FONT, fill=CATEGORY_FILL, border=BORDER),
+    "category_fill": dict(fill=CATEGORY_FILL, border=BORDER),
+    "item_excused": dict(fill=EXCUSED_FILL, border=BORDER),
+    "item_excused_center": dict(fill=EXCUSED_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "item_zero": dict(fill=ZERO_SCORE_FILL, border=BORDER),
+    "item_zero_center": dict(fill=ZERO_SCORE_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "item_score": dict(fill=SCORE_FILL, border=BORDER),
+    "item_score_center": dict(fill=SCORE_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "body": dict(border=BORDER),
+    "body_center": dict(border=BORDER, alignment=CENTER_ALIGN),
+    "weight_header": dict(font=CATEGORY_FONT, fill=WEIGHT_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "summary": dict(font=HEADER_FONT, fill=SUMMARY_FILL, border=BORDER),
+    "summary_center": dict(font=HEADER_FONT, fill=SUMMARY_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "excused_total": dict(font=CATEGORY_FONT, fill=EXCUSED_FILL, border=BORDER),
+    "excused_total_center": dict(font=CATEGORY_FONT, fill=EXCUSED_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "present": dict(fill=PRESENT_FILL, border=BORDER, alignment=CENTER_ALIGN),
+    "absent": dict(fill=ABSENT_FILL, border=BORDER, alignment=CENTER_ALIGN),
+}
+
+# Output formats offered for download: label -> (write_sheets() format,
+# file extension, MIME type, description used in messages). The plain formats
+# skip all cell styling.
+OUTPUT_FORMATS = {
+    "Excel (styled)": ("xlsx", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "Excel File"),
+    "Excel (plain, faster)": ("xlsx_plain", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "Excel File"),
+    "ZIP of CSV files (fastest)": ("csv", ".zip", "application/zip", "ZIP of CSV Files"),
+}
+
+# Characters Excel does not allow in sheet names, as a str.translate() table
+# that deletes them
+SHEET_NAME_INVALID_CHARS = str.maketrans('', '', '[]:*?/\\')
+
+# Characters allowed in sheet names but not in Windows file names, deleted
+# from the .csv entry names of the CSV ZIP output
+CSV_NAME_INVALID_CHARS = str.maketrans('', '', '"<>|')
+
+# Common date patterns for is_date_column, compiled once as a single alternation
+DATE_PATTERN = re.compile("|".join([
+    r'^\d{1,2}/\d{1,2}/\d{2,4}$',  # M/D/YY or MM/DD/YYYY
+    r'^\d{1,2}-\d{1,2}-\d{2,4}$',  # M-D-YY or MM-DD-YYYY
+    r'^\d{4}-\d{1,2}-\d{1,2}$',    # YYYY-MM-DD
+    r'^\d{1,2}\.\d{1,2}\.\d{2,4}$',  # M.D.YY or MM.DD.YYYY
+    r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2},?\s*\d{2,4}$',  # Mon D, YYYY
+    r'^\d{1,2}\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{2,4}$',  # D Mon YYYY
+    r'^(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s*\d{2,4}$',
+]), re.IGNORECASE)
+
+# Common column names that is_date_column never treats as dates
+NON_DATE_WORDS = frozenset([
+    'id', 'name', 'first', 'last', 'student', 'exam', 'test', 'quiz',
+    'assignment', 'homework', 'participation', 'attendance', 'grade',
+    'score', 'total', 'final', 'midterm', 'civics', 'other'
+])
+
+
+def stripped_text(series):
+    """Return the values of series as stripped strings, with missing values as ''."""
+    return series.astype(object).where(series.notna(), "").map(str).str.strip().tolist()
+
+
+@functools.lru_cache(maxsize=4096)
 def is_date_column(column_name):
-    """Check if a column name looks like a date."""
+    """Check if a column name looks like a date (memoized, as the dateutil fallback is slow)."""
     if not column_name or not isinstance(column_name, str):
         return False
 
     column_str = str(column_name).strip()
 
-    # Common date patterns to check
-    date_patterns = [
-        r'^\d{1,2}/\d{1,2}/\d{2,4}$',  # M/D/YY or MM/DD/YYYY
-        r'^\d{1,2}-\d{1,2}-\d{2,4}$',  # M-D-YY or MM-DD-YYYY
-        r'^\d{4}-\d{1,2}-\d{1,2}$',    # YYYY-MM-DD
-        r'^\d{1,2}\.\d{1,2}\.\d{2,4}$',  # M.D.YY or MM.DD.YYYY
-        r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2},?\s*\d{2,4}$',  # Mon D, YYYY
-        r'^\d{1,2}\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{2,4}$',  # D Mon YYYY
-        r'^(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s*\d{2,4}$',
-    ]
-
     # Check regex patterns
-    for pattern in date_patterns:
-        if re.match(pattern, column_str, re.IGNORECASE):
-            return True
+    if DATE_PATTERN.match(column_str):
+        return True
 
     # Try to parse as date using dateutil
     try:
@@ -41,10 +129,7 @@ def is_date_column(column_name):
         if column_str.isdigit() or len(column_str) < 4:
             return False
         # Check if it's a common non-date word
-        non_date_words = ['id', 'name', 'first', 'last', 'student', 'exam', 'test', 'quiz',
-                         'assignment', 'homework', 'participation', 'attendance', 'grade',
-                         'score', 'total', 'final', 'midterm', 'civics', 'other']
-        if column_str.lower() in non_date_words:
+        if column_str.lower() in NON_DATE_WORDS:
             return False
 
         parsed = date_parser.parse(column_str, fuzzy=False)
@@ -70,27 +155,52 @@ def detect_date_columns(columns, exclude_columns=None):
     return date_columns
 
 
+def upload_key(uploaded_file):
+    """Return a cache key for an upload: its file_id, or a hash of its bytes on Streamlit versions without one."""
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id is not None:
+        return file_id
+    return hashlib.md5(uploaded_file.getvalue()).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_numbers_file(file_id, _uploaded_file):
+    """
+    Parse an uploaded .numbers file, reusing the result on reruns with the same upload.
+
+    The cache is keyed on upload_key(), so reruns normally do not hash the file's bytes.
+    """
+    return parse_numbers_file(_uploaded_file)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_preview(file_id, _uploaded_file, rows=10):
+    """
+    First rows of the parsed upload for st.dataframe. Mixed-type columns (numbers
+    next to '') are turned into text here, as Streamlit would do after a failed
+    Arrow conversion, so each rerun converts the preview in one go.
+    """
+    preview = load_numbers_file(file_id, _uploaded_file).head(rows).copy()
+    for col in preview.columns:
+        if preview[col].dtype == object:
+            preview[col] = preview[col].astype("string")
+    return preview
+
+
 def parse_numbers_file(uploaded_file):
     """Parse a .numbers file and return a pandas DataFrame."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Save uploaded file to temp location
-        temp_numbers_path = os.path.join(temp_dir, "temp.numbers")
-        with open(temp_numbers_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+    # numbers-parser opens documents by path, so save the upload to a temp
+    # file; it reads the archive itself, so nothing needs to be extracted
+    with tempfile.NamedTemporaryFile(suffix=".numbers", delete=False) as f:
+        f.write(uploaded_file.getbuffer())
+        temp_numbers_path = f.name
 
-        # .numbers files are zip archives
+    try:
+        # .numbers files are zip archives; the table data lives under Index/Tables
         with zipfile.ZipFile(temp_numbers_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-
-        # Find and parse the tables
-        tables_dir = os.path.join(temp_dir, "Index", "Tables")
+            has_tables = any(name.startswith("Index/Tables/") for name in zip_ref.namelist())
 
-        if not os.path.exists(tables_dir):
-            # Try alternative structure
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith('.iwa'):
-                        pass  # .iwa files need special parsing
+        if not has_tables:
             raise ValueError("Could not find tables in the Numbers file. Please try exporting as CSV.")
 
         # For .numbers files, we need to use the numbers-parser library
@@ -104,19 +214,9 @@ def parse_numbers_file(uploaded_file):
             # Get the first table from the first sheet
             table = sheets[0].tables[0]
 
-            # Extract data
-            data = []
-            headers = []
-
-            for row_num, row in enumerate(table.iter_rows()):
-                row_data = []
-                for cell in row:
-                    row_data.append(cell.value if cell.value is not None else "")
-
-                if row_num == 0:
-                    headers = row_data
-                else:
-                    data.append(row_data)
+            # Extract data in one bulk read (empty cells come back as None)
+            rows = table.rows(values_only=True)
+            headers = rows[0] if rows else []
 
             # Convert headers to strings and handle datetime objects
             processed_headers = []
@@ -141,29 +241,71 @@ def parse_numbers_file(uploaded_file):
                     seen[h] = 0
                     unique_headers.append(h)
 
-            df = pd.DataFrame(data, columns=unique_headers)
+            # Store every empty cell as '' rather than NaN, so blanks show as
+            # blanks and one comparison finds them
+            df = pd.DataFrame(rows[1:], columns=unique_headers).fillna("")
+
+            # Store text columns made mostly of repeated values as categories,
+            # which shrinks them and makes the comparisons done on every rerun
+            # work on integer codes. Columns mixing numbers and text stay as
+            # they are; the data preview cannot display them as categories.
+            for col in df.select_dtypes(include=["object", "string"]).columns:
+                if df[col].nunique() < 0.5 * len(df) and pd.api.types.infer_dtype(df[col]) == "string":
+                    df[col] = df[col].astype("category")
+
             return df
 
         except ImportError:
             raise ImportError("The 'numbers-parser' library is required. Please install it with: pip install numbers-parser")
+    finally:
+        os.remove(temp_numbers_path)
+
+
+def count_valid_students(df, identifier_columns):
+    """
+    Count rows where at least one identifier column is filled in.
+
+    parse_numbers_file() stores every empty cell as '', so a single
+    comparison finds them; no separate notna() pass is needed.
+    """
+    return int(df[identifier_columns].ne('').to_numpy().any(axis=1).sum())
+
+
+def non_identifier_columns(columns, identifier_columns):
+    """Return columns, in order, without the identifier columns."""
+    identifier_set = set(identifier_columns)
+    return [col for col in columns if col not in identifier_set]
+
+
+def coerce_grades(df, columns):
+    """Convert grade columns to a float matrix, treating blanks and text as 0."""
+    return df[columns].apply(pd.to_numeric, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+
+
+def find_excused(df, columns):
+    """Return a boolean matrix marking excused grades (E or e)."""
+    return df[columns].apply(lambda s: s.astype(str).str.strip().str.upper().eq('E')).to_numpy(dtype=bool)
 
 
+@st.cache_data(show_spinner=False, max_entries=16)
 def categorize_columns(columns, category_keywords):
     """Categorize columns based on keywords."""
     categorized = {}
     uncategorized = []
 
+    # Lowercase every keyword once rather than on each column comparison
+    keyword_table = [
+        (category, [keyword.lower() for keyword in keywords])
+        for category, keywords in category_keywords.items()
+    ]
+
     for col in columns:
         col_lower = col.lower()
-        found_category = None
-
-        for category, keywords in category_keywords.items():
-            for keyword in keywords:
-                if keyword.lower() in col_lower:
-                    found_category = category
-                    break
-            if found_category:
-                break
+        found_category = next(
+            (category for category, keywords in keyword_table
+             if any(keyword in col_lower for keyword in keywords)),
+            None
+        )
 
         if found_category:
             if found_category not in categorized:
@@ -175,41 +317,298 @@ def categorize_columns(columns, category_keywords):
     return categorized, uncategorized
 
 
-def create_student_excel(df, id_column, first_name_column, last_name_column, category_keywords, show_category_averages, category_max_points=None, category_weights=None, item_max_points=None):
-    """Create an Excel file with each student on their own sheet."""
+def add_cell_styles(wb):
+    """Register every entry of CELL_STYLES on wb as a named style."""
+    for name, attributes in CELL_STYLES.items():
+        # Fall back to the workbook defaults so unstyled parts match plain cells
+        attributes = {"font": DEFAULT_FONT, "border": DEFAULT_BORDER, **attributes}
+        wb.add_named_style(NamedStyle(name=name, **attributes))
+
+
+def styled_cell(ws, value=None, style=None):
+    """Build a WriteOnlyCell with a named style applied, ready for ws.append()."""
+    cell = WriteOnlyCell(ws, value=value)
+    if style is not None:
+        cell.style = style
+    return cell
+
+
+def write_rows(ws, rows, merged_ranges):
+    """Append rows of (value, style name) pairs to a write-only sheet and merge the given ranges."""
+    for cells in rows:
+        ws.append([styled_cell(ws, value, style) for value, style in cells])
+    # Record every merge at once; merged_cells.add() would check each range
+    # against all the ranges added before it
+    ws.merged_cells = MultiCellRange(" ".join(merged_ranges))
+
+
+def unique_sheet_name(last_name, first_name, idx, used_names):
+    """Return a valid, unused "Last Name, First Name" sheet name and record it in used_names."""
+    # Create sheet name as "Last Name, First Name"
+    sheet_name = f"{last_name}, {first_name}"
+
+    # Sanitize sheet name (Excel has restrictions)
+    safe_name = sheet_name[:31].translate(SHEET_NAME_INVALID_CHARS)  # Max 31 chars
+    if not safe_name or safe_name == ", ":
+        safe_name = f"Student_{idx}"
+
+    # Handle duplicate sheet names (Excel compares them case-insensitively)
+    original_name = safe_name
+    counter = 1
+    while safe_name.casefold() in used_names:
+        safe_name = f"{original_name[:28]}_{counter}"
+        counter += 1
+    used_names.add(safe_name.casefold())
+    return safe_name
+
+
+class SheetProgress:
+    """
+    Progress bar for the sheet builders. It is created inside the cached function
+    so st.cache_data can replay it, and only redraws when the whole percentage changes.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.percent = 0
+        self.bar = st.progress(0, text=f"Writing sheet 0 of {total}")
+
+    def sheet_done(self):
+        self.done += 1
+        percent = self.done * 100 // self.total
+        if percent != self.percent:
+            self.percent = percent
+            self.bar.progress(percent, text=f"Writing sheet {self.done} of {self.total}")
+
+    def close(self):
+        self.bar.empty()
+
+
+def write_sheets(sheets, output_format, column_widths):
+    """
+    Save (sheet name, rows, merged ranges) triples in the given output format.
+
+    "xlsx" writes a styled workbook, "xlsx_plain" the same workbook without
+    styles or merges, and "csv" a ZIP archive with one CSV file per sheet.
+    Returns the file as a BytesIO.
+    """
     output = io.BytesIO()
-    wb = Workbook()
 
-    # Remove default sheet
-    wb.remove(wb.active)
+    if output_format == "csv":
+        used_names = set()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for sheet_name, rows, _ in sheets:
+                # Removing characters can make two names equal, so dedupe again
+                original_name = sheet_name.translate(CSV_NAME_INVALID_CHARS) or "Sheet"
+                file_name = original_name
+                counter = 1
+                while file_name.casefold() in used_names:
+                    file_name = f"{original_name}_{counter}"
+                    counter += 1
+                used_names.add(file_name.casefold())
+
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows([value for value, _ in cells] for cells in rows)
+                # The BOM makes Excel read the file as UTF-8 rather than the ANSI code page
+                zip_file.writestr(f"{file_name}.csv", buffer.getvalue().encode("utf-8-sig"))
+    else:
+        styled = output_format == "xlsx"
+        # Write-only mode streams rows straight to the file instead of keeping
+        # every cell of every sheet in memory
+        wb = Workbook(write_only=True)
+        if styled:
+            add_cell_styles(wb)
+
+        for sheet_name, rows, merged_ranges in sheets:
+            ws = wb.create_sheet(title=sheet_name)
+
+            # Column widths must be set before the first row is written
+            for column, width in column_widths.items():
+                ws.column_dimensions[column].width = width
+
+            if styled:
+                write_rows(ws, rows, merged_ranges)
+            else:
+                for cells in rows:
+                    ws.append([value for value, _ in cells])
+
+        wb.save(output)
 
+    output.seek(0)
+    return output
+
+
+def sort_by_last_name(df, last_name_column):
+    """Return df's rows ordered by last name, case-insensitively."""
+    # Take rows in the order of the lowered names, rather than copying the
+    # frame to add and drop a sort-key column
+    return df.take(np.asarray(df[last_name_column].astype(str).str.lower().argsort()))
+
+
+def student_info_rows(student_id, first_name, last_name):
+    """Rows for the ID, first name and last name block at the top of a sheet, plus a blank row."""
+    return [
+        [("ID:", "info"), (student_id, "info")],
+        [("First Name:", "info"), (first_name, "info")],
+        [("Last Name:", "info"), (last_name, "info")],
+        [],
+    ]
+
+
+def compute_category_totals(grade_matrix, excused_matrix, sections):
+    """
+    Earned and possible points of every student in every section.
+
+    Returns three students x sections matrices: earned points, possible
+    points, and whether any grade of the section counted (was not excused).
+    """
+    earned = np.zeros((grade_matrix.shape[0], len(sections)))
+    possible = np.zeros((grade_matrix.shape[0], len(sections)))
+    has_counted = np.zeros((grade_matrix.shape[0], len(sections)), dtype=bool)
+    for j, (_, _, positions, section_max_points) in enumerate(sections):
+        # Zero scores count, excused ones don't
+        counted = ~excused_matrix[:, positions]
+        has_counted[:, j] = counted.any(axis=1)
+        # cumsum adds left to right like sum() over the grades, so averages
+        # round the same way as a running total would
+        earned[:, j] = np.cumsum(np.where(counted, grade_matrix[:, positions], 0.0), axis=1)[:, -1]
+        possible[:, j] = np.cumsum(np.where(counted, section_max_points, 0.0), axis=1)[:, -1]
+    return earned, possible, has_counted
+
+
+def build_student_rows(student_id, first_name, last_name, grades, excused, totals, sections, show_category_averages, category_weights):
+    """
+    Lay out one student's grade sheet as rows of (value, style name) pairs.
+
+    grades and excused are the student's rows of the grade and excused
+    matrices. totals holds an (earned, possible) pair per section, or None
+    when every grade of the section was excused. sections lists (category,
+    items, positions, max points array) in sheet order, where items are
+    (column, position, max points) tuples.
+    Returns the rows (blank rows are empty lists) and the cell ranges to merge.
+    """
+    rows = student_info_rows(student_id, first_name, last_name)
+    merged_ranges = []
+    grade_row = grades.tolist()
+    excused_row = excused.tolist()
+    category_averages = {}
+    total_excused = 0  # Track total excused assignments
+
+    # Add headers
+    rows.append([("Categories", "header"), ("Score", "header"), ("Max Points", "header")])
+
+    # Add the grades of each category, with ungrouped columns last under "Other"
+    for (category, items, _, _), section_totals in zip(sections, totals):
+        # Category header
+        merged_ranges.append(f"A{len(rows) + 1}:C{len(rows) + 1}")
+        rows.append([(category.upper(), "category"), (None, "category_fill"), (None, "category_fill")])
+
+        for col, pos, item_max_points in items:
+            is_excused = excused_row[pos]
+
+            # Apply styling based on grade status
+            if is_excused:
+                grade = 'E'
+                total_excused += 1
+                item_style = "item_excused"
+            else:
+                grade = grade_row[pos]
+                # Highlight zero scores with light red and scores above zero with light green
+                item_style = "item_zero" if grade == 0 else "item_score"
+
+            rows.append([
+                (col, item_style),
+                (grade, f"{item_style}_center"),
+                (item_max_points if not is_excused else "Excused", f"{item_style}_center"),
+            ])
+
+        # Calculate category average as percentage
+        if section_totals is not None:
+            total_earned, total_possible = section_totals
+            category_averages[category] = (total_earned / total_possible * 100) if total_possible > 0 else 0
+
+    rows.append([])
+
+    # Add category averages if enabled
+    if show_category_averages and category_averages:
+        merged_ranges.append(f"A{len(rows) + 1}:C{len(rows) + 1}")
+        rows.append([("CATEGORY AVERAGES (%)", "section"), (None, "section_fill"), (None, "section_fill")])
+
+        for category, avg in category_averages.items():
+            rows.append([(category, "body"), (f"{round(avg, 2)}%", "body_center"), (None, "body")])
+
+        rows.append([])
+
+    excused_gap = 2  # Blank rows before the excused summary
+
+    # Add weighted grades section
+    if category_weights and category_averages:
+        # Header for weighted grades section
+        merged_ranges.append(f"A{len(rows) + 1}:D{len(rows) + 1}")
+        rows.append([("WEIGHTED GRADES", "section")] + [(None, "section_fill")] * 3)
+
+        # Column headers for weighted section
+        rows.append([(label, "weight_header") for label in ("Category", "Score (%)", "Weight (%)", "Weighted Score")])
+
+        # Calculate weighted scores for each category
+        total_weighted_score = 0
+        total_weight_used = 0
+
+        for category, avg_percentage in category_averages.items():
+            weight = category_weights.get(category, 0)
+            weighted_score = (avg_percentage * weight) / 100 if weight > 0 else 0
+
+            rows.append([
+                (category, "body"),
+                (f"{round(avg_percentage, 2)}%", "body_center"),
+                (f"{weight}%", "body_center"),
+                (round(weighted_score, 2), "body_center"),
+            ])
+
+            total_weighted_score += weighted_score
+            total_weight_used += weight
+
+        rows.append([])
+
+        # Final weighted grade
+        rows.append([
+            ("FINAL WEIGHTED GRADE", "summary"),
+            (f"{round(total_weighted_score, 2)}%", "summary_center"),
+            (f"(of {total_weight_used}%)", "summary_center"),
+            (None, "summary"),
+        ])
+        excused_gap = 1
+
+    # Add excused summary if there are any excused assignments
+    if total_excused > 0:
+        rows.extend([] for _ in range(excused_gap))
+        rows.append([
+            ("EXCUSED ASSIGNMENTS", "excused_total"),
+            (total_excused, "excused_total_center"),
+            (None, "item_excused"),
+        ])
+
+    return rows, merged_ranges
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_student_excel(_df, source_id, id_column, first_name_column, last_name_column, category_keywords, show_category_averages, category_max_points=None, category_weights=None, item_max_points=None, output_format="xlsx"):
+    """
+    Create an Excel file with each student on their own sheet (see write_sheets() for output_format).
+
+    _df is left out of the cache key; source_id (upload_key() of the upload) stands in
+    for it, so a cache lookup does not hash the whole frame.
+    """
     # Columns to exclude from grade columns (student identifier columns)
     identifier_columns = [id_column, first_name_column, last_name_column]
 
     # Get grade columns (all columns except the identifier columns)
-    grade_columns = [col for col in df.columns if col not in identifier_columns]
+    grade_columns = non_identifier_columns(_df.columns, identifier_columns)
 
     # Categorize columns
     categorized, uncategorized = categorize_columns(grade_columns, category_keywords)
 
-    # Style definitions
-    header_font = Font(bold=True, size=12)
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font_white = Font(bold=True, size=12, color="FFFFFF")
-    category_fill = PatternFill(start_color="B4C6E7", end_color="B4C6E7", fill_type="solid")
-    category_font = Font(bold=True, size=11)
-    weight_fill = PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid")  # Light orange for weighted section
-    excused_fill = PatternFill(start_color="FFE699", end_color="FFE699", fill_type="solid")  # Light orange/yellow for excused
-    zero_score_fill = PatternFill(start_color="FFCCCB", end_color="FFCCCB", fill_type="solid")  # Light red for zero scores
-    score_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Light green for scores above zero
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal='center', vertical='center')
-
     # Initialize category_max_points if not provided
     if category_max_points is None:
         category_max_points = {}
@@ -223,491 +622,208 @@ def create_student_excel(df, id_column, first_name_column, last_name_column, cat
         item_max_points = {}
 
     # Sort dataframe by last name alphabetically
-    df_sorted = df.copy()
-    df_sorted['_sort_key'] = df_sorted[last_name_column].astype(str).str.lower()
-    df_sorted = df_sorted.sort_values('_sort_key')
-    df_sorted = df_sorted.drop('_sort_key', axis=1)
-
-    # Create a sheet for each student
-    for idx, row in df_sorted.iterrows():
-        student_id = str(row[id_column]).strip() if pd.notna(row[id_column]) else ""
-        first_name = str(row[first_name_column]).strip() if pd.notna(row[first_name_column]) else ""
-        last_name = str(row[last_name_column]).strip() if pd.notna(row[last_name_column]) else ""
-
-        # Skip rows where ID, first name, and last name are all empty
-        if not student_id and not first_name and not last_name:
-            continue
-
-        # Create sheet name as "Last Name, First Name"
-        sheet_name = f"{last_name}, {first_name}"
-
-        # Sanitize sheet name (Excel has restrictions)
-        safe_name = sheet_name[:31]  # Max 31 chars
-        safe_name = ''.join(c for c in safe_name if c not in '[]:*?/\\')
-        if not safe_name or safe_name == ", ":
-            safe_name = f"Student_{idx}"
-
-        # Handle duplicate sheet names
-        original_name = safe_name
-        counter = 1
-        while safe_name in wb.sheetnames:
-            safe_name = f"{original_name[:28]}_{counter}"
-            counter += 1
-
-        ws = wb.create_sheet(title=safe_name)
-
-        # Add student identifier info at top of sheet
-        ws['A1'] = "ID:"
-        ws['B1'] = student_id
-        ws['A1'].font = header_font
-        ws['B1'].font = Font(bold=True, size=12)
-
-        ws['A2'] = "First Name:"
-        ws['B2'] = first_name
-        ws['A2'].font = header_font
-        ws['B2'].font = Font(bold=True, size=12)
-
-        ws['A3'] = "Last Name:"
-        ws['B3'] = last_name
-        ws['A3'].font = header_font
-        ws['B3'].font = Font(bold=True, size=12)
-
-        current_row = 5  # Start after ID, First Name, Last Name, and a blank row
-        all_grades = []
-        all_max_points = []
-        category_averages = {}
-        total_excused = 0  # Track total excused assignments
-
-        # Add headers
-        ws.cell(row=current_row, column=1, value="Categories")
-        ws.cell(row=current_row, column=2, value="Score")
-        ws.cell(row=current_row, column=3, value="Max Points")
-        for col in range(1, 4):
-            ws.cell(row=current_row, column=col).font = header_font_white
-            ws.cell(row=current_row, column=col).fill = header_fill
-            ws.cell(row=current_row, column=col).border = border
-            ws.cell(row=current_row, column=col).alignment = center_align
-
-        current_row += 1
-
-        # Add categorized grades
-        for category, columns in categorized.items():
-            # Category header
-            ws.cell(row=current_row, column=1, value=category.upper())
-            ws.cell(row=current_row, column=1).font = category_font
-            for col in range(1, 4):
-                ws.cell(row=current_row, column=col).fill = category_fill
-                ws.cell(row=current_row, column=col).border = border
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=3)
-            current_row += 1
-
-            # Get default max points for this category
-            default_max_points = category_max_points.get(category, 100)
-
-            category_grades = []
-            category_max = []
-            for col in columns:
-                cell_value = row[col]
-                is_excused = False
-
-                # Check if the grade is excused (E or e)
-                if pd.notna(cell_value) and str(cell_value).strip().upper() == 'E':
-                    is_excused = True
-                    grade = 'E'
-                    total_excused += 1
-                else:
-                    try:
-                        grade = float(cell_value) if pd.notna(cell_value) and cell_value != '' else 0
-                    except (ValueError, TypeError):
-                        grade = 0
-
-                # Use per-item max points if set, otherwise use category default
-                max_points = item_max_points.get(col, default_max_points)
-
-                ws.cell(row=current_row, column=1, value=col)
-                ws.cell(row=current_row, column=2, value=grade)
-                ws.cell(row=current_row, column=3, value=max_points if not is_excused else "Excused")
-                for c in range(1, 4):
-                    ws.cell(row=current_row, column=c).border = border
-                ws.cell(row=current_row, column=2).alignment = center_align
-                ws.cell(row=current_row, column=3).alignment = center_align
-
-                # Apply styling based on grade status
-                if is_excused:
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = excused_fill
-                elif grade == 0:
-                    # Highlight zero scores with light red
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = zero_score_fill
-                    # Still count zero scores toward averages
-                    category_grades.append(grade)
-                    category_max.append(max_points)
-                    all_grades.append(grade)
-                    all_max_points.append(max_points)
-                else:
-                    # Highlight scores above zero with light green
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = score_fill
-                    # Count non-excused grades toward averages
-                    category_grades.append(grade)
-                    category_max.append(max_points)
-                    all_grades.append(grade)
-                    all_max_points.append(max_points)
-
-                current_row += 1
-
-            # Calculate category average as percentage
-            if category_grades and category_max:
-                total_earned = sum(category_grades)
-                total_possible = sum(category_max)
-                category_averages[category] = (total_earned / total_possible * 100) if total_possible > 0 else 0
-
-        # Add uncategorized grades
-        if uncategorized:
-            ws.cell(row=current_row, column=1, value="OTHER")
-            ws.cell(row=current_row, column=1).font = category_font
-            for col in range(1, 4):
-                ws.cell(row=current_row, column=col).fill = category_fill
-                ws.cell(row=current_row, column=col).border = border
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=3)
-            current_row += 1
-
-            # Get default max points for "Other" category
-            default_other_max_points = category_max_points.get("Other", 100)
-
-            other_grades = []
-            other_max = []
-            for col in uncategorized:
-                cell_value = row[col]
-                is_excused = False
-
-                # Check if the grade is excused (E or e)
-                if pd.notna(cell_value) and str(cell_value).strip().upper() == 'E':
-                    is_excused = True
-                    grade = 'E'
-                    total_excused += 1
-                else:
-                    try:
-                        grade = float(cell_value) if pd.notna(cell_value) and cell_value != '' else 0
-                    except (ValueError, TypeError):
-                        grade = 0
-
-                # Use per-item max points if set, otherwise use "Other" default
-                other_max_points = item_max_points.get(col, default_other_max_points)
-
-                ws.cell(row=current_row, column=1, value=col)
-                ws.cell(row=current_row, column=2, value=grade)
-                ws.cell(row=current_row, column=3, value=other_max_points if not is_excused else "Excused")
-                for c in range(1, 4):
-                    ws.cell(row=current_row, column=c).border = border
-                ws.cell(row=current_row, column=2).alignment = center_align
-                ws.cell(row=current_row, column=3).alignment = center_align
-
-                # Apply styling based on grade status
-                if is_excused:
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = excused_fill
-                elif grade == 0:
-                    # Highlight zero scores with light red
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = zero_score_fill
-                    # Still count zero scores toward averages
-                    other_grades.append(grade)
-                    other_max.append(other_max_points)
-                    all_grades.append(grade)
-                    all_max_points.append(other_max_points)
-                else:
-                    # Highlight scores above zero with light green
-                    for c in range(1, 4):
-                        ws.cell(row=current_row, column=c).fill = score_fill
-                    # Count non-excused grades toward averages
-                    other_grades.append(grade)
-                    other_max.append(other_max_points)
-                    all_grades.append(grade)
-                    all_max_points.append(other_max_points)
-
-                current_row += 1
-
-            if other_grades and other_max:
-                total_earned = sum(other_grades)
-                total_possible = sum(other_max)
-                category_averages["Other"] = (total_earned / total_possible * 100) if total_possible > 0 else 0
-
-        current_row += 1
-
-        # Add category averages if enabled
-        if show_category_averages and category_averages:
-            ws.cell(row=current_row, column=1, value="CATEGORY AVERAGES (%)")
-            ws.cell(row=current_row, column=1).font = header_font_white
-            for col in range(1, 4):
-                ws.cell(row=current_row, column=col).fill = header_fill
-                ws.cell(row=current_row, column=col).border = border
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=3)
-            current_row += 1
-
-            for category, avg in category_averages.items():
-                ws.cell(row=current_row, column=1, value=category)
-                ws.cell(row=current_row, column=2, value=f"{round(avg, 2)}%")
-                for c in range(1, 4):
-                    ws.cell(row=current_row, column=c).border = border
-                ws.cell(row=current_row, column=2).alignment = center_align
-                current_row += 1
-
-            current_row += 1
-
-        # Add weighted grades section
-        if category_weights and category_averages:
-            # Header for weighted grades section
-            ws.cell(row=current_row, column=1, value="WEIGHTED GRADES")
-            ws.cell(row=current_row, column=1).font = header_font_white
-            for col in range(1, 5):
-                ws.cell(row=current_row, column=col).fill = header_fill
-                ws.cell(row=current_row, column=col).border = border
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=4)
-            current_row += 1
-
-            # Column headers for weighted section
-            ws.cell(row=current_row, column=1, value="Category")
-            ws.cell(row=current_row, column=2, value="Score (%)")
-            ws.cell(row=current_row, column=3, value="Weight (%)")
-            ws.cell(row=current_row, column=4, value="Weighted Score")
-            for col in range(1, 5):
-                ws.cell(row=current_row, column=col).font = category_font
-                ws.cell(row=current_row, column=col).fill = weight_fill
-                ws.cell(row=current_row, column=col).border = border
-                ws.cell(row=current_row, column=col).alignment = center_align
-            current_row += 1
-
-            # Calculate weighted scores for each category
-            total_weighted_score = 0
-            total_weight_used = 0
-
-            for category, avg_percentage in category_averages.items():
-                weight = category_weights.get(category, 0)
-                weighted_score = (avg_percentage * weight) / 100 if weight > 0 else 0
-
-                ws.cell(row=current_row, column=1, value=category)
-                ws.cell(row=current_row, column=2, value=f"{round(avg_percentage, 2)}%")
-                ws.cell(row=current_row, column=3, value=f"{weight}%")
-                ws.cell(row=current_row, column=4, value=round(weighted_score, 2))
-                for col in range(1, 5):
-                    ws.cell(row=current_row, column=col).border = border
-                ws.cell(row=current_row, column=2).alignment = center_align
-                ws.cell(row=current_row, column=3).alignment = center_align
-                ws.cell(row=current_row, column=4).alignment = center_align
-
-                total_weighted_score += weighted_score
-                total_weight_used += weight
-                current_row += 1
-
-            current_row += 1
-
-            # Final weighted grade
-            ws.cell(row=current_row, column=1, value="FINAL WEIGHTED GRADE")
-            ws.cell(row=current_row, column=2, value=f"{round(total_weighted_score, 2)}%")
-            ws.cell(row=current_row, column=3, value=f"(of {total_weight_used}%)")
-            for col in range(1, 5):
-                ws.cell(row=current_row, column=col).font = Font(bold=True, size=12)
-                ws.cell(row=current_row, column=col).fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-                ws.cell(row=current_row, column=col).border = border
-            ws.cell(row=current_row, column=2).alignment = center_align
-            ws.cell(row=current_row, column=3).alignment = center_align
-
-        # Add excused summary if there are any excused assignments
-        if total_excused > 0:
-            current_row += 2
-
-            ws.cell(row=current_row, column=1, value="EXCUSED ASSIGNMENTS")
-            ws.cell(row=current_row, column=2, value=total_excused)
-            ws.cell(row=current_row, column=1).font = Font(bold=True, size=11)
-            ws.cell(row=current_row, column=2).font = Font(bold=True, size=11)
-            for col in range(1, 4):
-                ws.cell(row=current_row, column=col).fill = excused_fill
-                ws.cell(row=current_row, column=col).border = border
-            ws.cell(row=current_row, column=2).alignment = center_align
-
-        # Adjust column widths
-        ws.column_dimensions['A'].width = 35
-        ws.column_dimensions['B'].width = 15
-        ws.column_dimensions['C'].width = 15
-        ws.column_dimensions['D'].width = 15
-
-    wb.save(output)
-    output.seek(0)
+    df_sorted = sort_by_last_name(_df, last_name_column)
+
+    # Stripped identifier text for every student, ahead of the per-student loop
+    student_ids = stripped_text(df_sorted[id_column])
+    first_names = stripped_text(df_sorted[first_name_column])
+    last_names = stripped_text(df_sorted[last_name_column])
+
+    # Coerce every grade to a number once, ahead of the per-student loop
+    grade_pos = {col: pos for pos, col in enumerate(grade_columns)}
+    grade_matrix = coerce_grades(df_sorted, grade_columns)
+    excused_matrix = find_excused(df_sorted, grade_columns)
+
+    # Sheet sections in order, ungrouped columns last under "Other". Each keeps
+    # its column positions and max points as arrays, so category totals are
+    # array sums instead of per-student Python lists.
+    column_groups = list(categorized.items())
+    if uncategorized:
+        column_groups.append(("Other", uncategorized))
+    sections = []
+    for category, columns in column_groups:
+        # Use per-item max points if set, otherwise use category default
+        default_max_points = category_max_points.get(category, 100)
+        items = [(col, grade_pos[col], item_max_points.get(col, default_max_points)) for col in columns]
+        positions = np.array([pos for _, pos, _ in items], dtype=int)
+        section_max_points = np.array([points for _, _, points in items], dtype=float)
+        sections.append((category, items, positions, section_max_points))
+
+    # Category totals for the whole roster at once, ahead of the per-student loop
+    earned_matrix, possible_matrix, counted_matrix = compute_category_totals(grade_matrix, excused_matrix, sections)
+
+    def student_sheets():
+        # Sheet names taken so far, for duplicate handling
+        used_names = set()
+
+        # Create a sheet for each student
+        for i, (idx, student_id, first_name, last_name) in enumerate(zip(df_sorted.index, student_ids, first_names, last_names)):
+            # Skip rows where ID, first name, and last name are all empty
+            if not student_id and not first_name and not last_name:
+                continue
+
+            totals = [
+                (earned, possible) if counted else None
+                for earned, possible, counted in zip(earned_matrix[i].tolist(), possible_matrix[i].tolist(), counted_matrix[i].tolist())
+            ]
+            rows, merged_ranges = build_student_rows(
+                student_id, first_name, last_name, grade_matrix[i], excused_matrix[i],
+                totals, sections, show_category_averages, category_weights
+            )
+            yield unique_sheet_name(last_name, first_name, idx, used_names), rows, merged_ranges
+            progress.sheet_done()
+
+    progress = SheetProgress(sum(1 for names in zip(student_ids, first_names, last_names) if any(names)))
+    output = write_sheets(student_sheets(), output_format, {'A': 35, 'B': 15, 'C': 15, 'D': 15})
+    progress.close()
     return output
 
 
-def create_attendance_excel(df, id_column, first_name_column, last_name_column, attendance_columns):
-    """Create an Excel file with attendance records for each student."""
-    output = io.BytesIO()
-    wb = Workbook()
-
-    # Remove default sheet
-    wb.remove(wb.active)
-
-    # Style definitions
-    header_font = Font(bold=True, size=12)
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font_white = Font(bold=True, size=12, color="FFFFFF")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal='center', vertical='center')
+def build_attendance_rows(student_id, first_name, last_name, attendance_columns, attendance):
+    """
+    Lay out one student's attendance sheet as rows of (value, style name) pairs.
+
+    attendance is the student's row of the attendance matrix. Returns the rows
+    (blank rows are empty lists) and the cell ranges to merge.
+    """
+    rows = student_info_rows(student_id, first_name, last_name)
+
+    # Add headers for attendance
+    rows.append([("Date", "header"), ("Attendance", "header")])
+
+    # Add attendance records
+    total_present = 0
+    total_days = 0
+
+    for date_col, grade in zip(attendance_columns, attendance.tolist()):
+        grade = int(grade) if grade in [0, 1] else grade
+
+        # Color code based on attendance (0 = absent/orange, 1 = present/green)
+        if grade == 1:
+            attendance_style = "present"
+            total_present += 1
+        elif grade == 0:
+            attendance_style = "absent"
+        else:
+            attendance_style = "body_center"
+
+        rows.append([(date_col, "body"), (grade, attendance_style)])
+        total_days += 1
+
+    # Add summary row
+    rows.append([])
+    attendance_rate = (total_present / total_days * 100) if total_days > 0 else 0
+
+    merged_ranges = [f"A{len(rows) + 1}:B{len(rows) + 1}"]
+    rows.append([("ATTENDANCE SUMMARY", "section"), (None, "section_fill")])
+
+    total_absent = total_days - total_present
+    rows.append([("Days Present:", "body"), (total_present, "body_center")])
+    rows.append([("Days Absent:", "body"), (total_absent, "body_center")])
+    rows.append([("Total Days:", "body"), (total_days, "body_center")])
+    rows.append([("Attendance Rate:", "summary"), (f"{round(attendance_rate, 1)}%", "summary_center")])
+
+    return rows, merged_ranges
 
-    # Color fills for attendance grades
-    present_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Green for 1 (present)
-    absent_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")  # Light red/orange for 0 (absent)
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_attendance_excel(_df, source_id, id_column, first_name_column, last_name_column, attendance_columns, output_format="xlsx"):
+    """
+    Create an Excel file with attendance records for each student (see write_sheets() for output_format).
+
+    The frame is keyed by source_id as in create_student_excel().
+    """
     # Sort dataframe by last name alphabetically
-    df_sorted = df.copy()
-    df_sorted['_sort_key'] = df_sorted[last_name_column].astype(str).str.lower()
-    df_sorted = df_sorted.sort_values('_sort_key')
-    df_sorted = df_sorted.drop('_sort_key', axis=1)
-
-    # Create a sheet for each student
-    for idx, row in df_sorted.iterrows():
-        student_id = str(row[id_column]).strip() if pd.notna(row[id_column]) else ""
-        first_name = str(row[first_name_column]).strip() if pd.notna(row[first_name_column]) else ""
-        last_name = str(row[last_name_column]).strip() if pd.notna(row[last_name_column]) else ""
-
-        # Skip rows where ID, first name, and last name are all empty
-        if not student_id and not first_name and not last_name:
-            continue
-
-        # Create sheet name as "Last Name, First Name"
-        sheet_name = f"{last_name}, {first_name}"
-
-        # Sanitize sheet name (Excel has restrictions)
-        safe_name = sheet_name[:31]  # Max 31 chars
-        safe_name = ''.join(c for c in safe_name if c not in '[]:*?/\\')
-        if not safe_name or safe_name == ", ":
-            safe_name = f"Student_{idx}"
-
-        # Handle duplicate sheet names
-        original_name = safe_name
-        counter = 1
-        while safe_name in wb.sheetnames:
-            safe_name = f"{original_name[:28]}_{counter}"
-            counter += 1
-
-        ws = wb.create_sheet(title=safe_name)
-
-        # Add student identifier info at top of sheet
-        ws['A1'] = "ID:"
-        ws['B1'] = student_id
-        ws['A1'].font = header_font
-        ws['B1'].font = Font(bold=True, size=12)
-
-        ws['A2'] = "First Name:"
-        ws['B2'] = first_name
-        ws['A2'].font = header_font
-        ws['B2'].font = Font(bold=True, size=12)
-
-        ws['A3'] = "Last Name:"
-        ws['B3'] = last_name
-        ws['A3'].font = header_font
-        ws['B3'].font = Font(bold=True, size=12)
-
-        current_row = 5  # Start after student info and a blank row
-
-        # Add headers for attendance
-        ws.cell(row=current_row, column=1, value="Date")
-        ws.cell(row=current_row, column=2, value="Attendance")
-        for col in range(1, 3):
-            ws.cell(row=current_row, column=col).font = header_font_white
-            ws.cell(row=current_row, column=col).fill = header_fill
-            ws.cell(row=current_row, column=col).border = border
-            ws.cell(row=current_row, column=col).alignment = center_align
-
-        current_row += 1
-
-        # Add attendance records
-        total_present = 0
-        total_days = 0
-
-        for date_col in attendance_columns:
-            try:
-                grade = float(row[date_col]) if pd.notna(row[date_col]) and row[date_col] != '' else 0
-                grade = int(grade) if grade in [0, 1] else grade
-            except (ValueError, TypeError):
-                grade = 0
-
-            ws.cell(row=current_row, column=1, value=date_col)
-            ws.cell(row=current_row, column=2, value=grade)
-
-            # Apply styling
-            ws.cell(row=current_row, column=1).border = border
-            ws.cell(row=current_row, column=2).border = border
-            ws.cell(row=current_row, column=2).alignment = center_align
-
-            # Color code based on attendance (0 = absent/orange, 1 = present/green)
-            if grade == 1:
-                ws.cell(row=current_row, column=2).fill = present_fill
-                total_present += 1
-            elif grade == 0:
-                ws.cell(row=current_row, column=2).fill = absent_fill
-
-            total_days += 1
-            current_row += 1
-
-        # Add summary row
-        current_row += 1
-        attendance_rate = (total_present / total_days * 100) if total_days > 0 else 0
-
-        ws.cell(row=current_row, column=1, value="ATTENDANCE SUMMARY")
-        ws.cell(row=current_row, column=1).font = header_font_white
-        ws.cell(row=current_row, column=1).fill = header_fill
-        ws.cell(row=current_row, column=2).fill = header_fill
-        ws.cell(row=current_row, column=1).border = border
-        ws.cell(row=current_row, column=2).border = border
-        ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=2)
-        current_row += 1
-
-        ws.cell(row=current_row, column=1, value="Days Present:")
-        ws.cell(row=current_row, column=2, value=total_present)
-        ws.cell(row=current_row, column=1).border = border
-        ws.cell(row=current_row, column=2).border = border
-        ws.cell(row=current_row, column=2).alignment = center_align
-        current_row += 1
-
-        total_absent = total_days - total_present
-        ws.cell(row=current_row, column=1, value="Days Absent:")
-        ws.cell(row=current_row, column=2, value=total_absent)
-        ws.cell(row=current_row, column=1).border = border
-        ws.cell(row=current_row, column=2).border = border
-        ws.cell(row=current_row, column=2).alignment = center_align
-        current_row += 1
-
-        ws.cell(row=current_row, column=1, value="Total Days:")
-        ws.cell(row=current_row, column=2, value=total_days)
-        ws.cell(row=current_row, column=1).border = border
-        ws.cell(row=current_row, column=2).border = border
-        ws.cell(row=current_row, column=2).alignment = center_align
-        current_row += 1
-
-        ws.cell(row=current_row, column=1, value="Attendance Rate:")
-        ws.cell(row=current_row, column=2, value=f"{round(attendance_rate, 1)}%")
-        ws.cell(row=current_row, column=1).font = Font(bold=True, size=12)
-        ws.cell(row=current_row, column=2).font = Font(bold=True, size=12)
-        ws.cell(row=current_row, column=1).fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-        ws.cell(row=current_row, column=2).fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-        ws.cell(row=current_row, column=1).border = border
-        ws.cell(row=current_row, column=2).border = border
-        ws.cell(row=current_row, column=2).alignment = center_align
-
-        # Adjust column widths
-        ws.column_dimensions['A'].width = 25
-        ws.column_dimensions['B'].width = 15
-
-    wb.save(output)
-    output.seek(0)
+    df_sorted = sort_by_last_name(_df, last_name_column)
+
+    # Stripped identifier text for every student, ahead of the per-student loop
+    student_ids = stripped_text(df_sorted[id_column])
+    first_names = stripped_text(df_sorted[first_name_column])
+    last_names = stripped_text(df_sorted[last_name_column])
+
+    # Coerce every attendance value to a number once, ahead of the per-student loop
+    attendance_matrix = coerce_grades(df_sorted, attendance_columns)
+
+    def attendance_sheets():
+        # Sheet names taken so far, for duplicate handling
+        used_names = set()
+
+        # Create a sheet for each student
+        for i, (idx, student_id, first_name, last_name) in enumerate(zip(df_sorted.index, student_ids, first_names, last_names)):
+            # Skip rows where ID, first name, and last name are all empty
+            if not student_id and not first_name and not last_name:
+                continue
+
+            rows, merged_ranges = build_attendance_rows(student_id, first_name, last_name, attendance_columns, attendance_matrix[i])
+            yield unique_sheet_name(last_name, first_name, idx, used_names), rows, merged_ranges
+            progress.sheet_done()
+
+    progress = SheetProgress(sum(1 for names in zip(student_ids, first_names, last_names) if any(names)))
+    output = write_sheets(attendance_sheets(), output_format, {'A': 25, 'B': 15})
+    progress.close()
     return output
 
 
+def find_column_index(columns, keywords, default=0):
+    """Return the index of the first column whose name contains any keyword."""
+    for i, col in enumerate(columns):
+        col_lower = str(col).lower()
+        for keyword in keywords:
+            if keyword in col_lower:
+                return i
+    return default
+
+
+def render_identifier_pickers(df, key_prefix):
+    """
+    Show the ID / last name / first name selectboxes shared by both tabs.
+
+    Widget keys are "<key_prefix>_id_col" etc. Returns (id, first, last).
+    """
+    col_options = df.columns.tolist()
+
+    # Auto-detect column indices based on column names
+    id_index = find_column_index(col_options, ['id', 'student id', 'studentid'], 0)
+    lname_index = find_column_index(col_options, ['last name', 'lastname', 'last_name', 'lname'], 1 if len(col_options) > 1 else 0)
+    fname_index = find_column_index(col_options, ['first name', 'firstname', 'first_name', 'fname'], 2 if len(col_options) > 2 else 0)
+
+    id_col, lname_col, fname_col = st.columns(3)
+    with id_col:
+        id_column = st.selectbox(
+            "ID Column",
+            options=col_options,
+            index=id_index,
+            key=f"{key_prefix}_id_col"
+        )
+    with lname_col:
+        last_name_column = st.selectbox(
+            "Last Name Column",
+            options=col_options,
+            index=lname_index,
+            key=f"{key_prefix}_lname_col"
+        )
+    with fname_col:
+        first_name_column = st.selectbox(
+            "First Name Column",
+            options=col_options,
+            index=fname_index,
+            key=f"{key_prefix}_fname_col"
+        )
+    return id_column, first_name_column, last_name_column
+
+
+def bullet_list(items):
+    """Markdown with one "• item" paragraph per item."""
+    return "\n\n".join(f"• {item}" for item in items)
+
+
+def render_valid_count(df, identifier_columns):
+    """Show how many rows have at least one identifier filled in and return it."""
+    valid_student_count = count_valid_students(df, identifier_columns)
+    st.info(f"📈 Found **{valid_student_count}** valid students (excluding empty rows)")
+    return valid_student_count
+
+
 def main():
     st.set_page_config(
         page_title="GradeBook Transfer",
@@ -944,12 +1060,13 @@ def main():
 
             with st.spinner("🔄 Parsing Numbers file..."):
                 try:
-                    df = parse_numbers_file(uploaded_file)
+                    file_key = upload_key(uploaded_file)
+                    df = load_numbers_file(file_key, uploaded_file)
                     st.success("✅ File parsed successfully!")
 
                     # Show preview
                     st.subheader("📊 Data Preview")
-                    st.dataframe(df.head(10), use_container_width=True)
+                    st.dataframe(load_preview(file_key, uploaded_file), use_container_width=True)
 
                     st.info(f"📈 Found **{len(df)}** rows and **{len(df.columns)}** columns")
 
@@ -957,72 +1074,30 @@ def main():
                     st.subheader("🏷️ Select Student Identifier Columns")
                     st.caption("Select the columns that contain student ID, first name, and last name. These will appear at the top of each student's sheet and will not be categorized as grades.")
 
-                    col_options = df.columns.tolist()
-
-                    # Auto-detect column indices based on column names
-                    def find_column_index(columns, keywords, default=0):
-                        for i, col in enumerate(columns):
-                            col_lower = str(col).lower()
-                            for keyword in keywords:
-                                if keyword in col_lower:
-                                    return i
-                        return default
-
-                    id_index = find_column_index(col_options, ['id', 'student id', 'studentid'], 0)
-                    lname_index = find_column_index(col_options, ['last name', 'lastname', 'last_name', 'lname'], 1 if len(col_options) > 1 else 0)
-                    fname_index = find_column_index(col_options, ['first name', 'firstname', 'first_name', 'fname'], 2 if len(col_options) > 2 else 0)
-
-                    id_col, lname_col, fname_col = st.columns(3)
-                    with id_col:
-                        id_column = st.selectbox(
-                            "ID Column",
-                            options=col_options,
-                            index=id_index,
-                            key="grades_id_col"
-                        )
-                    with lname_col:
-                        last_name_column = st.selectbox(
-                            "Last Name Column",
-                            options=col_options,
-                            index=lname_index,
-                            key="grades_lname_col"
-                        )
-                    with fname_col:
-                        first_name_column = st.selectbox(
-                            "First Name Column",
-                            options=col_options,
-                            index=fname_index,
-                            key="grades_fname_col"
-                        )
+                    id_column, first_name_column, last_name_column = render_identifier_pickers(df, "grades")
 
                     # Count valid students (rows where at least one identifier is not empty)
                     identifier_columns = [id_column, first_name_column, last_name_column]
-                    valid_students = df[
-                        (df[id_column].notna() & (df[id_column] != '')) |
-                        (df[first_name_column].notna() & (df[first_name_column] != '')) |
-                        (df[last_name_column].notna() & (df[last_name_column] != ''))
-                    ]
-                    st.info(f"📈 Found **{len(valid_students)}** valid students (excluding empty rows)")
+                    valid_student_count = render_valid_count(df, identifier_columns)
 
                     # Show category detection preview
                     st.subheader("🗂️ Category Detection Preview")
-                    grade_columns = [col for col in df.columns if col not in identifier_columns]
+                    grade_columns = non_identifier_columns(df.columns, identifier_columns)
                     categorized, uncategorized = categorize_columns(grade_columns, st.session_state.categories)
 
+                    # Each column list is one markdown element rather than one per column
                     col1, col2 = st.columns(2)
 
                     with col1:
                         st.markdown("**Categorized Columns:**")
                         for category, columns in categorized.items():
                             with st.expander(f"{category} ({len(columns)} items)"):
-                                for col in columns:
-                                    st.write(f"• {col}")
+                                st.write(bullet_list(columns))
 
                     with col2:
                         st.markdown("**Uncategorized Columns:**")
                         if uncategorized:
-                            for col in uncategorized:
-                                st.write(f"• {col}")
+                            st.write(bullet_list(uncategorized))
                             st.caption("💡 Add keywords in the sidebar to categorize these columns")
                         else:
                             st.write("All columns are categorized!")
@@ -1032,40 +1107,39 @@ def main():
                     st.caption("Override the default max points for specific assignments. Leave blank to use the category default.")
 
                     with st.expander("Customize individual item max points", expanded=False):
-                        for category, columns in categorized.items():
-                            default_max = st.session_state.category_max_points.get(category, 100)
-                            st.markdown(f"**{category}** (default: {default_max} pts)")
-                            for col in columns:
-                                col_key = f"item_max_{col}"
-                                current_val = st.session_state.item_max_points.get(col)
-                                custom_max = st.number_input(
-                                    f"{col}",
-                                    min_value=1,
-                                    value=current_val if current_val else default_max,
-                                    key=col_key,
-                                    help=f"Custom max points for {col}"
-                                )
+                        # One editable table for every item, rather than a number input each
+                        item_rows = [
+                            (category, col, st.session_state.category_max_points.get(category, 100))
+                            for category, columns in list(categorized.items()) + [("Other", uncategorized)]
+                            for col in columns
+                        ]
+                        if item_rows:
+                            item_table = pd.DataFrame(item_rows, columns=["Category", "Item", "Default"])
+                            item_table["Max Points"] = [
+                                st.session_state.item_max_points.get(col, default_max)
+                                for _, col, default_max in item_rows
+                            ]
+                            edited_items = st.data_editor(
+                                item_table,
+                                column_config={
+                                    "Max Points": st.column_config.NumberColumn(
+                                        min_value=1,
+                                        step=1,
+                                        help="Custom max points for this item. Leave blank to use the category default."
+                                    )
+                                },
+                                disabled=["Category", "Item", "Default"],
+                                hide_index=True,
+                                use_container_width=True,
+                                num_rows="fixed",
+                                # Edits are kept by row position, so the key follows the item
+                                # list and edits never move onto another item
+                                key=f"item_max_points_{zlib.crc32(repr([col for _, col, _ in item_rows]).encode())}"
+                            )
+                            for (_, col, default_max), custom_max in zip(item_rows, edited_items["Max Points"].tolist()):
                                 # Only store if different from default
-                                if custom_max != default_max:
-                                    st.session_state.item_max_points[col] = custom_max
-                                elif col in st.session_state.item_max_points:
-                                    del st.session_state.item_max_points[col]
-
-                        if uncategorized:
-                            default_other = st.session_state.category_max_points.get("Other", 100)
-                            st.markdown(f"**Other** (default: {default_other} pts)")
-                            for col in uncategorized:
-                                col_key = f"item_max_{col}"
-                                current_val = st.session_state.item_max_points.get(col)
-                                custom_max = st.number_input(
-                                    f"{col}",
-                                    min_value=1,
-                                    value=current_val if current_val else default_other,
-                                    key=col_key,
-                                    help=f"Custom max points for {col}"
-                                )
-                                if custom_max != default_other:
-                                    st.session_state.item_max_points[col] = custom_max
+                                if pd.notna(custom_max) and int(custom_max) != default_max:
+                                    st.session_state.item_max_points[col] = int(custom_max)
                                 elif col in st.session_state.item_max_points:
                                     del st.session_state.item_max_points[col]
 
@@ -1077,10 +1151,20 @@ def main():
                     # Generate Excel
                     st.subheader("📥 Generate Excel File")
 
-                    if st.button("🚀 Generate Excel File", type="primary", use_container_width=True, key="generate_grades"):
-                        with st.spinner("🔄 Creating Excel file with individual student sheets..."):
+                    output_format_label = st.radio(
+                        "Output format",
+                        list(OUTPUT_FORMATS),
+                        horizontal=True,
+                        key="grades_output_format",
+                        help="Plain Excel and CSV files leave out colors and borders, which makes large classes much faster to generate"
+                    )
+                    output_format, file_extension, mime_type, file_description = OUTPUT_FORMATS[output_format_label]
+
+                    if st.button(f"🚀 Generate {file_description}", type="primary", use_container_width=True, key="generate_grades"):
+                        with st.spinner(f"🔄 Creating {file_description} with individual student sheets..."):
                             excel_output = create_student_excel(
                                 df,
+                                file_key,
                                 id_column,
                                 first_name_column,
                                 last_name_column,
@@ -1088,14 +1172,15 @@ def main():
                                 show_category_averages,
                                 st.session_state.category_max_points,
                                 st.session_state.category_weights,
-                                st.session_state.item_max_points
+                                st.session_state.item_max_points,
+                                output_format
                             )
 
-                            st.success("✅ Excel file generated successfully!")
+                            st.success(f"✅ {file_description} generated successfully!")
 
                             # Summary
                             st.subheader("✨ Generation Complete!")
-                            st.write(f"Created **{len(valid_students)}** individual student sheets")
+                            st.write(f"Created **{valid_student_count}** individual student sheets")
                             st.write("Each sheet contains:")
                             summary_items = [
                                 "Student ID, First Name, and Last Name",
@@ -1111,10 +1196,10 @@ def main():
 
                             # Download button
                             st.download_button(
-                                label="📥 Download Excel File",
+                                label=f"📥 Download {file_description}",
                                 data=excel_output,
-                                file_name="gradebook_transfer.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                file_name=f"gradebook_transfer{file_extension}",
+                                mime=mime_type,
                                 use_container_width=True,
                                 key="download_grades"
                             )
@@ -1158,87 +1243,51 @@ def main():
 
             with st.spinner("🔄 Parsing Numbers file..."):
                 try:
-                    att_df = parse_numbers_file(attendance_file)
+                    att_file_key = upload_key(attendance_file)
+                    att_df = load_numbers_file(att_file_key, attendance_file)
                     st.success("✅ File parsed successfully!")
 
                     # Show preview
                     st.subheader("📊 Data Preview")
-                    st.dataframe(att_df.head(10), use_container_width=True)
+                    st.dataframe(load_preview(att_file_key, attendance_file), use_container_width=True)
 
                     st.info(f"📈 Found **{len(att_df)}** rows and **{len(att_df.columns)}** columns")
 
                     # Select student identifier columns
                     st.subheader("🏷️ Select Student Identifier Columns")
 
-                    att_col_options = att_df.columns.tolist()
-
-                    # Auto-detect column indices based on column names
-                    def find_column_index(columns, keywords, default=0):
-                        for i, col in enumerate(columns):
-                            col_lower = str(col).lower()
-                            for keyword in keywords:
-                                if keyword in col_lower:
-                                    return i
-                        return default
-
-                    att_id_index = find_column_index(att_col_options, ['id', 'student id', 'studentid'], 0)
-                    att_lname_index = find_column_index(att_col_options, ['last name', 'lastname', 'last_name', 'lname'], 1 if len(att_col_options) > 1 else 0)
-                    att_fname_index = find_column_index(att_col_options, ['first name', 'firstname', 'first_name', 'fname'], 2 if len(att_col_options) > 2 else 0)
-
-                    id_col, lname_col, fname_col = st.columns(3)
-                    with id_col:
-                        att_id_column = st.selectbox(
-                            "ID Column",
-                            options=att_col_options,
-                            index=att_id_index,
-                            key="att_id_col"
-                        )
-                    with lname_col:
-                        att_last_name_column = st.selectbox(
-                            "Last Name Column",
-                            options=att_col_options,
-                            index=att_lname_index,
-                            key="att_lname_col"
-                        )
-                    with fname_col:
-                        att_first_name_column = st.selectbox(
-                            "First Name Column",
-                            options=att_col_options,
-                            index=att_fname_index,
-                            key="att_fname_col"
-                        )
+                    att_id_column, att_first_name_column, att_last_name_column = render_identifier_pickers(att_df, "att")
 
                     # Count valid students
                     att_identifier_columns = [att_id_column, att_first_name_column, att_last_name_column]
-                    att_valid_students = att_df[
-                        (att_df[att_id_column].notna() & (att_df[att_id_column] != '')) |
-                        (att_df[att_first_name_column].notna() & (att_df[att_first_name_column] != '')) |
-                        (att_df[att_last_name_column].notna() & (att_df[att_last_name_column] != ''))
-                    ]
-                    st.info(f"📈 Found **{len(att_valid_students)}** valid students (excluding empty rows)")
+                    att_valid_student_count = render_valid_count(att_df, att_identifier_columns)
 
                     # Select attendance date columns
                     st.subheader("📅 Attendance Date Columns")
 
                     # Get available columns (excluding identifier columns)
-                    available_columns = [col for col in att_df.columns if col not in att_identifier_columns]
-
-                    # Auto-detect date columns
-                    auto_detected_dates = detect_date_columns(available_columns)
+                    available_columns = non_identifier_columns(att_df.columns, att_identifier_columns)
+
+                    # Auto-detect date columns once per set of available columns and seed
+                    # the multiselect through session state, so later reruns neither repeat
+                    # the detection nor resend the whole default list
+                    if (st.session_state.get("attendance_columns_source") != available_columns
+                            or "attendance_columns" not in st.session_state):
+                        st.session_state.auto_detected_dates = detect_date_columns(available_columns)
+                        st.session_state.attendance_columns = st.session_state.auto_detected_dates
+                        st.session_state.attendance_columns_source = available_columns
+                    auto_detected_dates = st.session_state.auto_detected_dates
 
                     if auto_detected_dates:
                         st.success(f"Auto-detected **{len(auto_detected_dates)}** date columns")
-                        default_selection = auto_detected_dates
                     else:
                         st.warning("No date columns auto-detected. Please select manually.")
-                        default_selection = []
 
                     st.caption("Columns with date names are auto-selected. You can modify the selection if needed.")
 
                     attendance_columns = st.multiselect(
                         "Select date columns",
                         options=available_columns,
-                        default=default_selection,
                         key="attendance_columns"
                     )
 
@@ -1250,23 +1299,34 @@ def main():
                         # Generate Excel
                         st.subheader("📥 Generate Attendance Excel File")
 
-                        if st.button("🚀 Generate Attendance Excel", type="primary", use_container_width=True, key="generate_attendance"):
-                            with st.spinner("🔄 Creating attendance Excel file..."):
+                        att_output_format_label = st.radio(
+                            "Output format",
+                            list(OUTPUT_FORMATS),
+                            horizontal=True,
+                            key="attendance_output_format",
+                            help="Plain Excel and CSV files leave out colors and borders, which makes large classes much faster to generate"
+                        )
+                        att_output_format, att_file_extension, att_mime_type, att_file_description = OUTPUT_FORMATS[att_output_format_label]
+
+                        if st.button(f"🚀 Generate Attendance {att_file_description}", type="primary", use_container_width=True, key="generate_attendance"):
+                            with st.spinner(f"🔄 Creating attendance {att_file_description}..."):
                                 attendance_output = create_attendance_excel(
                                     att_df,
+                                    att_file_key,
                                     att_id_column,
                                     att_first_name_column,
                                     att_last_name_column,
-                                    attendance_columns
+                                    attendance_columns,
+                                    att_output_format
                                 )
 
-                                st.success("✅ Attendance Excel file generated successfully!")
+                                st.success(f"✅ Attendance {att_file_description} generated successfully!")
 
                                 # Summary
                                 st.markdown(f"""
                                 <div class="success-box">
                                     <h4>✨ Generation Complete!</h4>
-                                    <p>Created <strong>{len(att_valid_students)}</strong> individual student sheets</p>
+                                    <p>Created <strong>{att_valid_student_count}</strong> individual student sheets</p>
                                     <p>Each sheet contains:</p>
                                     <ul>
                                         <li>Student ID, First Name, and Last Name</li>
@@ -1279,10 +1339,10 @@ def main():
 
                                 # Download button
                                 st.download_button(
-                                    label="📥 Download Attendance Excel",
+                                    label=f"📥 Download Attendance {att_file_description}",
                                     data=attendance_output,
-                                    file_name="attendance_report.xlsx",
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                    file_name=f"attendance_report{att_file_extension}",
+                                    mime=att_mime_type,
                                     use_container_width=True,
                                     key="download_attendance"
                                 )